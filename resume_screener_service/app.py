@@ -1,35 +1,127 @@
 # resume_screener_service/app.py
 
 from flask import Flask, request, jsonify
+from flask.json.provider import JSONProvider
 from flask_cors import CORS # Import CORS for cross-origin requests
 import os
+import hashlib # For content hashes used as cache keys
 import uuid # For unique filenames
 from werkzeug.utils import secure_filename # Recommended for secure filenames
-import tempfile # For temporary file storage
 import logging # For logging messages to console
+import orjson # Fast JSON encoding for API responses
+import numpy as np # For sorting candidates by score
 
 # Configure basic logging for Flask app
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# LOG_LEVEL=DEBUG shows per-file progress; WARNING is a sensible production setting
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper(), format='%(asctime)s - %(levelname)s - %(message)s')
 app_logger = logging.getLogger(__name__) # Get logger for this module
 
 # Import your utility functions
 # Make sure these imports correctly point to your utils/ and database/ directories
-from utils.resume_parser import extract_text_from_file, parse_resume_info
-from utils.scoring_logic import score_resume, model_sbert # Import the SBERT model instance
-from database.db_manager import create_tables, insert_resume, insert_screening_result
+from utils.resume_parser import extract_text_from_stream, parse_resumes_info, PARSER_VERSION, get_nlp
+from utils.scoring_logic import (score_resumes_batch, encode_resumes_for_scoring, start_embed_worker,
+                                 embedding_model_id, get_sbert_model) # Shared SBERT model, loaded on first use
+from database.db_manager import (create_tables, insert_resumes_and_results, get_cached_resumes, cache_resumes,
+                                 get_cached_jd_embedding, cache_jd_embedding)
+
+class OrjsonProvider(JSONProvider):
+    """Flask JSON provider backed by orjson, used by jsonify and request.get_json."""
+    def dumps(self, obj, **kwargs):
+        # NumPy scalars/arrays (scores, embeddings) are serialized natively instead of raising
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 app.debug = True # REMEMBER: Set to False for production!
 CORS(app) # Enable CORS for all routes, important for frontend communication
 
-# Ensure database tables are created when the app starts
-app_logger.info("Checking/creating database tables...")
-create_tables()
-app_logger.info("Database setup complete.")
+def setup_database():
+    """Creates/migrates the database tables. Run once per deployment, not in every worker process."""
+    app_logger.info("Checking/creating database tables...")
+    create_tables()
+    app_logger.info("Database setup complete.")
+
+@app.cli.command("create-db")
+def create_db_command():
+    """Create or migrate the database tables (run once at deploy time: flask --app app create-db)."""
+    setup_database()
+
+def warm_up_models():
+    """
+    Loads spaCy and the SBERT model and starts the embed worker, so the first request does not pay for the
+    model download or the INT8 ONNX export. Called by the server process at startup; scoring worker
+    processes import this module without calling it, so they load no model.
+    """
+    app_logger.info("Loading models...")
+    get_nlp()
+    get_sbert_model()
+    # The embed worker serves all SBERT embedding requests from one background thread,
+    # batching texts across concurrent requests
+    start_embed_worker()
+    app_logger.info("Models loaded.")
+
+@app.cli.command("prepare-models")
+def prepare_models_command():
+    """Download the models and export the INT8 ONNX model to disk (run once at deploy time: flask --app app prepare-models)."""
+    warm_up_models()
+
+
+def _content_hash(text):
+    """SHA-256 of a resume/JD text, used as the parse and embedding cache key."""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def _extract_resume(resume_file):
+    """
+    Extracts the text of one uploaded resume.
+    Returns the screening entry for the file, which later passes fill in.
+    """
+    original_filename = secure_filename(resume_file.filename)
+    app_logger.debug("Processing file: %s", original_filename)
+
+    entry = {
+        "filename": original_filename,
+        "raw_text": None,
+        "content_hash": None,
+        "parsed_data": {},
+        "embedding": None, # SBERT embedding of the raw text, from the cache or computed below
+        "cache_dirty": False, # True when parsed_data/embedding are new and need to be cached
+        "resume_db_id": None, # Database ID for the resume
+        "ai_score": 0.0,
+        "ai_reasoning": "Processing failed.",
+        "parsed": False,
+        "scored": False
+    }
+
+    try:
+        # The upload is read straight from its in-memory stream, no temporary file on disk
+        app_logger.debug("Extracting text from %s...", original_filename)
+        raw_text = extract_text_from_stream(resume_file.stream, os.path.splitext(original_filename)[1])
+        if not raw_text:
+            raise ValueError("Could not extract text from resume. File might be empty or unreadable.")
+        entry["raw_text"] = raw_text
+        entry["content_hash"] = _content_hash(raw_text)
+        app_logger.debug("Text extracted from %s. Length: %d chars.", original_filename, len(raw_text))
+
+    except ValueError as ve:
+        entry["ai_reasoning"] = f"File processing/parsing error: {ve}"
+        app_logger.error("ValueError during resume processing: %s", ve, exc_info=True)
+    except Exception as e:
+        entry["ai_reasoning"] = f"Server error during processing: {str(e)}"
+        app_logger.error("Unhandled error processing %s: %s", original_filename, e, exc_info=True)
+
+    return entry
 
 @app.route('/screen_resumes', methods=['POST'])
 def screen_resumes_endpoint():
     app_logger.info("Received request to /screen_resumes")
+    # Both are no-ops once warm_up_models has run at startup
+    sbert_model = get_sbert_model()
+    start_embed_worker()
+    # Cached embeddings are only reused when they were produced by this same model and backend
+    embedding_model = embedding_model_id(sbert_model)
 
     # 1. Validate Input: Job Description
     if 'job_description' not in request.form:
@@ -37,7 +129,7 @@ def screen_resumes_endpoint():
         return jsonify({"error": "Missing 'job_description' form field"}), 400
     
     job_description = request.form['job_description']
-    app_logger.info(f"Job Description received. Length: {len(job_description)} chars.")
+    app_logger.info("Job Description received. Length: %d chars.", len(job_description))
 
     # 2. Validate Input: Resume Files
     if 'resume_files' not in request.files:
@@ -49,92 +141,132 @@ def screen_resumes_endpoint():
         app_logger.warning("No files selected or uploaded.")
         return jsonify({"error": "No files selected or uploaded"}), 400
 
-    app_logger.info(f"Received {len(resume_files)} resume file(s).")
-    processed_candidates = []
-    
-    for resume_file in resume_files:
-        if resume_file.filename == '':
-            continue # Skip empty file fields
-
-        original_filename = secure_filename(resume_file.filename)
-        app_logger.info(f"Processing file: {original_filename}")
-        
-        # Use tempfile to ensure proper handling of temporary files
-        temp_file_fd, temp_file_path = tempfile.mkstemp(suffix=os.path.splitext(original_filename)[1])
-        os.close(temp_file_fd) # Close file descriptor immediately after creation
-        resume_file.save(temp_file_path) # Save the uploaded file to the temp path
-        app_logger.info(f"Saved temporary file to: {temp_file_path}")
-
-        parsed_data = {}
-        ai_score = 0.0
-        ai_reasoning = "Processing failed."
-        resume_db_id = None # Database ID for the resume
+    app_logger.info("Received %d resume file(s).", len(resume_files))
 
-        try:
-            # 1. Extract Text from Resume File
-            app_logger.info("Extracting text from resume file...")
-            raw_text = extract_text_from_file(temp_file_path)
-            if not raw_text:
-                raise ValueError("Could not extract text from resume. File might be empty or unreadable.")
-            app_logger.info(f"Text extracted. Length: {len(raw_text)} chars.")
-
-            # 2. Parse Information from Resume Text
-            app_logger.info("Parsing information from extracted text...")
-            parsed_data = parse_resume_info(raw_text)
-            app_logger.info(f"Parsed data: Name={parsed_data.get('name')}, Skills={len(parsed_data.get('skills', []))} found.")
-            
-            # 3. Store Raw and Parsed Data in Database
-            app_logger.info("Inserting resume into database...")
-            resume_db_id = insert_resume(original_filename, parsed_data)
-            if not resume_db_id:
-                raise Exception("Failed to save resume to database.")
-            app_logger.info(f"Resume saved to DB with ID: {resume_db_id}")
-
-            # 4. Score Resume against Job Description
-            app_logger.info("Scoring resume against job description...")
-            # model_sbert is loaded globally in scoring_logic.py
-            ai_score, ai_reasoning = score_resume(parsed_data, job_description, model_sbert)
-            app_logger.info(f"Scoring complete. Score: {ai_score}, Reasoning: {ai_reasoning}")
-            
-            # 5. Store Screening Result in Database
-            app_logger.info("Inserting screening result into database...")
-            insert_screening_result(resume_db_id, job_description, ai_score, ai_reasoning)
-            app_logger.info("Screening result saved to DB.")
+    # Pass 1: extract text from every resume.
+    # Parsing and scoring are deferred so that spaCy and SBERT can each process all resumes in one batch.
+    # Files are extracted one at a time: PyMuPDF (fitz) does not support use from several threads, and
+    # neither it nor python-docx releases the GIL, so a thread pool would add risk without any overlap.
+    # One entry per uploaded file, in upload order; empty file fields are skipped
+    screened = [_extract_resume(resume_file) for resume_file in resume_files if resume_file.filename != '']
 
+    extracted_entries = [entry for entry in screened if entry["raw_text"]]
+
+    # Pass 2: parse information from all extracted texts, batching them through spaCy.
+    # Resumes seen before (same text hash) take their parsed data and embedding from the cache instead.
+    # Entries from an older parser count as misses; embeddings from another model come back as None and are recomputed
+    cached_resumes = get_cached_resumes({entry["content_hash"] for entry in extracted_entries},
+                                        PARSER_VERSION, embedding_model)
+    to_parse = []
+    for entry in extracted_entries:
+        if entry["content_hash"] in cached_resumes:
+            entry["parsed_data"], entry["embedding"] = cached_resumes[entry["content_hash"]]
+            entry["parsed"] = True
+        else:
+            to_parse.append(entry)
+    app_logger.info("Resume cache: %d hit(s), %d miss(es).", len(extracted_entries) - len(to_parse), len(to_parse))
+
+    if to_parse:
+        try:
+            app_logger.info("Parsing information from %d extracted text(s)...", len(to_parse))
+            parsed_results = parse_resumes_info([entry["raw_text"] for entry in to_parse])
+            for entry, parsed_data in zip(to_parse, parsed_results):
+                entry["parsed_data"] = parsed_data
+                entry["parsed"] = True
+                entry["cache_dirty"] = True
+                app_logger.debug("Parsed data for %s: Name=%s, Skills=%d found.",
+                                 entry['filename'], parsed_data.get('name'), len(parsed_data.get('skills', [])))
         except ValueError as ve:
-            ai_reasoning = f"File processing/parsing error: {ve}"
-            app_logger.error(f"ValueError during resume processing: {ve}", exc_info=True)
+            for entry in to_parse:
+                entry["ai_reasoning"] = f"File processing/parsing error: {ve}"
+            app_logger.error("ValueError during resume parsing: %s", ve, exc_info=True)
+        except Exception as e:
+            for entry in to_parse:
+                entry["ai_reasoning"] = f"Server error during processing: {str(e)}"
+            app_logger.error("Unhandled error parsing resumes: %s", e, exc_info=True)
+
+    parsed_entries = [entry for entry in screened if entry["parsed"]]
+
+    # Pass 3: embed the JD and all parsed resumes not already cached in a single batched forward pass
+    jd_resp_embedding, resume_embeddings = None, None
+    if parsed_entries:
+        try:
+            jd_hash = _content_hash(job_description)
+            cached_jd_embedding = get_cached_jd_embedding(jd_hash, embedding_model)
+            app_logger.info("Encoding %d resume(s) in one batch...", sum(entry['embedding'] is None for entry in parsed_entries))
+            jd_resp_embedding, resume_embeddings = encode_resumes_for_scoring(
+                [entry["parsed_data"] for entry in parsed_entries], job_description, sbert_model,
+                jd_resp_embedding=cached_jd_embedding,
+                resume_embeddings=[entry["embedding"] for entry in parsed_entries])
+            if resume_embeddings is not None:
+                for entry, embedding in zip(parsed_entries, resume_embeddings):
+                    if entry["embedding"] is None:
+                        entry["embedding"] = embedding
+                        entry["cache_dirty"] = True
+            if cached_jd_embedding is None and jd_resp_embedding is not None:
+                cache_jd_embedding(jd_hash, jd_resp_embedding, embedding_model)
         except Exception as e:
-            ai_reasoning = f"Server error during processing: {str(e)}"
-            app_logger.error(f"Unhandled error processing {original_filename}: {e}", exc_info=True)
-        finally:
-            # Clean up the temporary file
-            if os.path.exists(temp_file_path):
-                os.remove(temp_file_path)
-                app_logger.info(f"Cleaned up temporary file: {temp_file_path}")
-            else:
-                app_logger.info(f"Temporary file not found for cleanup: {temp_file_path}")
-
-        processed_candidates.append({
-            "id": resume_db_id, # ID from your database
-            "filename": original_filename,
-            "name": parsed_data.get("name", "N/A"),
-            "score": round(ai_score, 2),
-            "reasoning": ai_reasoning,
-            "extracted_skills": parsed_data.get("skills", [])
-            # You can add more parsed data here if needed for UI display
-        })
-
-    # Sort candidates by score (highest first)
-    processed_candidates.sort(key=lambda x: x['score'], reverse=True)
-    app_logger.info(f"Finished processing all resumes. Returning {len(processed_candidates)} candidates.")
+            # score_resumes_batch retries the encoding itself
+            app_logger.error("Batched encoding failed, retrying during scoring: %s", e, exc_info=True)
+
+    # Pass 4: score all resumes against the job description in one batch
+    if parsed_entries:
+        try:
+            app_logger.info("Scoring %d resume(s) against job description...", len(parsed_entries))
+            results = score_resumes_batch([entry["parsed_data"] for entry in parsed_entries], job_description, sbert_model,
+                                          jd_resp_embedding=jd_resp_embedding, resume_embeddings=resume_embeddings)
+            for entry, (ai_score, ai_reasoning) in zip(parsed_entries, results):
+                entry["ai_score"], entry["ai_reasoning"] = ai_score, ai_reasoning
+                entry["scored"] = True
+                app_logger.debug("Scoring complete for %s. Score: %s, Reasoning: %s", entry['filename'], ai_score, ai_reasoning)
+        except Exception as e:
+            for entry in parsed_entries:
+                entry["ai_reasoning"] = f"Server error during processing: {str(e)}"
+            app_logger.error("Unhandled error scoring resumes: %s", e, exc_info=True)
+
+    # Cache new parse results and embeddings for the next upload of the same resumes
+    cache_resumes([
+        (entry["content_hash"], entry["parsed_data"], entry["embedding"])
+        for entry in parsed_entries if entry["cache_dirty"]
+    ], PARSER_VERSION, embedding_model)
+
+    # Pass 5: store all parsed resumes and their screening results in a single transaction
+    if parsed_entries:
+        app_logger.info("Inserting %d resume(s) and screening results into database...", len(parsed_entries))
+        resume_db_ids = insert_resumes_and_results([
+            (entry["filename"], entry["parsed_data"], entry["embedding"],
+             entry["ai_score"] if entry["scored"] else None, entry["ai_reasoning"])
+            for entry in parsed_entries
+        ], job_description, embedding_model)
+        if resume_db_ids:
+            for entry, resume_db_id in zip(parsed_entries, resume_db_ids):
+                entry["resume_db_id"] = resume_db_id
+            app_logger.info("Resumes and screening results saved to DB.")
+        else:
+            app_logger.error("Failed to save resumes and screening results to database.")
+
+    processed_candidates = [{
+        "id": entry["resume_db_id"], # ID from your database
+        "filename": entry["filename"],
+        "name": entry["parsed_data"].get("name", "N/A"),
+        "score": round(entry["ai_score"], 2),
+        "reasoning": entry["ai_reasoning"],
+        "extracted_skills": entry["parsed_data"].get("skills", [])
+        # You can add more parsed data here if needed for UI display
+    } for entry in screened]
+
+    # Sort candidates by score (highest first); a stable argsort keeps upload order among equal scores
+    scores = np.fromiter((candidate['score'] for candidate in processed_candidates), dtype=np.float64,
+                         count=len(processed_candidates))
+    processed_candidates = [processed_candidates[i] for i in np.argsort(-scores, kind='stable')]
+    app_logger.info("Finished processing all resumes. Returning %d candidates.", len(processed_candidates))
 
     return jsonify({"status": "success", "candidates": processed_candidates})
 
 # Global exception handler for Flask app
 @app.errorhandler(Exception)
 def handle_exception(e):
-    app_logger.error(f"An unhandled Flask exception occurred: {e}", exc_info=True)
+    app_logger.error("An unhandled Flask exception occurred: %s", e, exc_info=True)
     response = jsonify({
         "error": "An unexpected server error occurred.",
         "details": str(e), # Provide error details only in debug mode or for internal logging
@@ -147,5 +279,7 @@ def handle_exception(e):
 if __name__ == '__main__':
     # Ensure a directory for temp uploads exists if not using system temp
     # This example uses system tempfile, so no custom dir is strictly needed.
+    setup_database()
+    warm_up_models()
     app_logger.info("Starting Flask application...")
     app.run(debug=True, port=5001) # Use a different port than Project 1 (e.g., 5001)
\ No newline at end of file
@@ -1,149 +1,403 @@
 # resume_screener_service/database/db_manager.py
 
 import sqlite3
-import json
+import orjson # Faster drop-in for the json module; dumps returns bytes
 import os
+import threading
+import numpy as np
 
 DB_FILE = os.path.join(os.path.dirname(__file__), 'resume_screener.db')
 
+# A single connection is kept open for the life of the process instead of reconnecting on every call.
+# sqlite3 connections must not be used from two threads at once, so every helper holds _db_lock.
+_conn = None
+_db_lock = threading.Lock()
+
+def _embedding_to_blob(embedding):
+    """
+    Serializes an embedding vector for a BLOB column (None stays NULL).
+    Vectors are quantized to int8 with a per-vector scale, stored as a float32 scale followed by
+    the int8 values: 4x smaller than float32, and the error is negligible for cosine scoring.
+    """
+    if embedding is None:
+        return None
+    embedding = np.asarray(embedding, dtype=np.float32)
+    scale = float(np.max(np.abs(embedding))) / 127 or 1.0 # All-zero vectors keep a scale of 1
+    quantized = np.round(embedding / scale).astype(np.int8)
+    return np.float32(scale).tobytes() + quantized.tobytes()
+
+def _blob_to_embedding(blob):
+    """Deserializes an embedding BLOB back into a float32 vector (NULL becomes None)."""
+    if blob is None:
+        return None
+    scale = np.frombuffer(blob, dtype=np.float32, count=1)[0]
+    # Dequantized to float32 so scoring runs as a BLAS matmul; NumPy has no BLAS-backed int8 matmul
+    return np.frombuffer(blob, dtype=np.int8, offset=4).astype(np.float32) * scale
+
 def create_connection():
     """Create a database connection to the SQLite database."""
     conn = None
     try:
-        conn = sqlite3.connect(DB_FILE)
+        # isolation_level=None puts the connection in autocommit mode;
+        # multi-statement writes are wrapped in explicit BEGIN IMMEDIATE/COMMIT
+        conn = sqlite3.connect(DB_FILE, check_same_thread=False, isolation_level=None)
+        # WAL lets readers proceed during writes; NORMAL is durable under WAL and skips an fsync per commit
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
         return conn
     except sqlite3.Error as e:
         print(f"Error connecting to database: {e}")
     return conn
 
+def get_connection():
+    """Returns the shared database connection, opening it on first use."""
+    global _conn
+    with _db_lock:
+        if _conn is None:
+            _conn = create_connection()
+    return _conn
+
+def _rollback_if_open(conn):
+    """
+    Rolls back a transaction left open by a failed BEGIN ... COMMIT block, whatever the exception was.
+    The connection is shared, so an open transaction would otherwise swallow every later write.
+    """
+    if conn.in_transaction:
+        conn.execute("ROLLBACK")
+
 def create_tables():
     """Create tables if they don't exist."""
-    conn = create_connection()
+    conn = get_connection()
     if conn:
-        try:
-            cursor = conn.cursor()
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS resumes (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    filename TEXT NOT NULL,
-                    name TEXT,
-                    email TEXT,
-                    phone TEXT,
-                    skills TEXT, -- Stored as JSON string
-                    experience TEXT, -- Stored as JSON string
-                    education TEXT, -- Stored as JSON string
-                    raw_text TEXT,
-                    upload_timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS screening_results (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    resume_id INTEGER NOT NULL,
-                    job_description_id TEXT, -- Can be an ID from friend's service or direct JD text hash
-                    job_description_text TEXT NOT NULL,
-                    ai_score REAL NOT NULL,
-                    ai_reasoning TEXT,
-                    human_feedback_score REAL, -- For iterative learning
-                    human_feedback_comment TEXT,
-                    screening_timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (resume_id) REFERENCES resumes (id)
-                )
-            """)
-            conn.commit()
-            print("Database tables created/checked.")
-        except sqlite3.Error as e:
-            print(f"Error creating tables: {e}")
-        finally:
-            conn.close()
-
-def insert_resume(filename, parsed_data):
-    """Inserts a parsed resume into the database."""
-    conn = create_connection()
+        with _db_lock:
+            try:
+                cursor = conn.cursor()
+                cursor.execute("BEGIN IMMEDIATE")
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS resumes (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        filename TEXT NOT NULL,
+                        name TEXT,
+                        email TEXT,
+                        phone TEXT,
+                        skills TEXT, -- Stored as JSON string
+                        experience TEXT, -- Stored as JSON string
+                        education TEXT, -- Stored as JSON string
+                        raw_text TEXT,
+                        embedding BLOB, -- int8-quantized SBERT embedding of raw_text, reused across screenings
+                        upload_timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                        embedding_model TEXT -- Model/backend that produced embedding (see embedding_model_id)
+                    )
+                """)
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS screening_results (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        resume_id INTEGER NOT NULL,
+                        job_description_id TEXT, -- Can be an ID from friend's service or direct JD text hash
+                        job_description_text TEXT NOT NULL,
+                        ai_score REAL NOT NULL,
+                        ai_reasoning TEXT,
+                        human_feedback_score REAL, -- For iterative learning
+                        human_feedback_comment TEXT,
+                        screening_timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                        FOREIGN KEY (resume_id) REFERENCES resumes (id)
+                    )
+                """)
+                # Caches keyed by the SHA-256 of the resume/JD text, so repeat uploads skip parsing and SBERT.
+                # Each row records the parser version and embedding model that produced it; a row from another
+                # version or model is treated as a cache miss.
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS resume_cache (
+                        content_sha256 TEXT PRIMARY KEY,
+                        parsed_json TEXT NOT NULL, -- parse_resume_info output as JSON string
+                        embedding BLOB, -- int8-quantized SBERT embedding of the raw text, NULL until first computed
+                        parser_version INTEGER, -- PARSER_VERSION that produced parsed_json
+                        embedding_model TEXT -- Model/backend that produced embedding (see embedding_model_id)
+                    )
+                """)
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS jd_cache (
+                        content_sha256 TEXT PRIMARY KEY,
+                        embedding BLOB NOT NULL, -- int8-quantized SBERT embedding of the JD responsibilities
+                        embedding_model TEXT -- Model/backend that produced embedding (see embedding_model_id)
+                    )
+                """)
+                # Databases created before a column existed get it added in place;
+                # pre-existing rows have NULL versions/models and so never match
+                for table, column, column_type in [("resumes", "embedding", "BLOB"),
+                                                   ("resumes", "embedding_model", "TEXT"),
+                                                   ("resume_cache", "parser_version", "INTEGER"),
+                                                   ("resume_cache", "embedding_model", "TEXT"),
+                                                   ("jd_cache", "embedding_model", "TEXT")]:
+                    cursor.execute(f"PRAGMA table_info({table})")
+                    if column not in [existing[1] for existing in cursor.fetchall()]:
+                        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+                cursor.execute("COMMIT")
+                print("Database tables created/checked.")
+            except sqlite3.Error as e:
+                print(f"Error creating tables: {e}")
+            finally:
+                _rollback_if_open(conn)
+
+def insert_resume(filename, parsed_data, embedding=None, embedding_model=None):
+    """
+    Inserts a parsed resume, and optionally its SBERT embedding, into the database.
+    embedding_model identifies the model/backend that produced embedding (see get_embeddings_for_ids).
+    """
+    conn = get_connection()
     if conn:
-        try:
-            cursor = conn.cursor()
-            cursor.execute("""
-                INSERT INTO resumes (filename, name, email, phone, skills, experience, education, raw_text)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                filename,
-                parsed_data.get('name'),
-                parsed_data.get('email'),
-                parsed_data.get('phone'),
-                json.dumps(parsed_data.get('skills', [])),
-                json.dumps(parsed_data.get('experience', [])),
-                json.dumps(parsed_data.get('education', [])),
-                parsed_data.get('raw_text')
-            ))
-            conn.commit()
-            return cursor.lastrowid
-        except sqlite3.Error as e:
-            print(f"Error inserting resume: {e}")
-        finally:
-            conn.close()
+        with _db_lock:
+            try:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    INSERT INTO resumes (filename, name, email, phone, skills, experience, education, raw_text, embedding, embedding_model)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, (
+                    filename,
+                    parsed_data.get('name'),
+                    parsed_data.get('email'),
+                    parsed_data.get('phone'),
+                    orjson.dumps(parsed_data.get('skills', [])).decode('utf-8'),
+                    orjson.dumps(parsed_data.get('experience', [])).decode('utf-8'),
+                    orjson.dumps(parsed_data.get('education', [])).decode('utf-8'),
+                    parsed_data.get('raw_text'),
+                    _embedding_to_blob(embedding),
+                    embedding_model if embedding is not None else None
+                ))
+                return cursor.lastrowid
+            except (sqlite3.Error, orjson.JSONEncodeError) as e:
+                print(f"Error inserting resume: {e}")
     return None
 
 def insert_screening_result(resume_id, job_description_text, ai_score, ai_reasoning, job_description_id=None):
     """Inserts a screening result into the database."""
-    conn = create_connection()
+    conn = get_connection()
+    if conn:
+        with _db_lock:
+            try:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    INSERT INTO screening_results (resume_id, job_description_id, job_description_text, ai_score, ai_reasoning)
+                    VALUES (?, ?, ?, ?, ?)
+                """, (resume_id, job_description_id, job_description_text, ai_score, ai_reasoning))
+                return cursor.lastrowid
+            except sqlite3.Error as e:
+                print(f"Error inserting screening result: {e}")
+    return None
+
+def insert_resumes_and_results(rows, job_description_text, embedding_model, job_description_id=None):
+    """
+    Inserts a batch of resumes and their screening results in a single transaction.
+    rows is a list of (filename, parsed_data, embedding, ai_score, ai_reasoning) tuples; embedding
+    may be None, and rows whose ai_score is None only store the resume.
+    embedding_model identifies the model/backend that produced the embeddings (see get_embeddings_for_ids).
+    Returns the list of resume IDs in the same order as rows, or None on failure.
+    """
+    conn = get_connection()
     if conn:
+        # Parameters are serialized before the transaction starts, so a serialization error cannot interrupt it
         try:
-            cursor = conn.cursor()
-            cursor.execute("""
-                INSERT INTO screening_results (resume_id, job_description_id, job_description_text, ai_score, ai_reasoning)
-                VALUES (?, ?, ?, ?, ?)
-            """, (resume_id, job_description_id, job_description_text, ai_score, ai_reasoning))
-            conn.commit()
-            return cursor.lastrowid
-        except sqlite3.Error as e:
-            print(f"Error inserting screening result: {e}")
-        finally:
-            conn.close()
+            resume_params = [(
+                filename,
+                parsed_data.get('name'),
+                parsed_data.get('email'),
+                parsed_data.get('phone'),
+                orjson.dumps(parsed_data.get('skills', [])).decode('utf-8'),
+                orjson.dumps(parsed_data.get('experience', [])).decode('utf-8'),
+                orjson.dumps(parsed_data.get('education', [])).decode('utf-8'),
+                parsed_data.get('raw_text'),
+                _embedding_to_blob(embedding),
+                embedding_model if embedding is not None else None
+            ) for filename, parsed_data, embedding, _, _ in rows]
+        except orjson.JSONEncodeError as e: # e.g. lone surrogates, which stdlib json accepted but orjson rejects
+            print(f"Error serializing resume batch: {e}")
+            return None
+        with _db_lock:
+            try:
+                cursor = conn.cursor()
+                cursor.execute("BEGIN IMMEDIATE")
+                resume_ids = []
+                for params in resume_params:
+                    # executemany() does not report per-row IDs, so resumes are inserted one by one
+                    cursor.execute("""
+                        INSERT INTO resumes (filename, name, email, phone, skills, experience, education, raw_text, embedding, embedding_model)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    """, params)
+                    resume_ids.append(cursor.lastrowid)
+                cursor.executemany("""
+                    INSERT INTO screening_results (resume_id, job_description_id, job_description_text, ai_score, ai_reasoning)
+                    VALUES (?, ?, ?, ?, ?)
+                """, [
+                    (resume_id, job_description_id, job_description_text, ai_score, ai_reasoning)
+                    for resume_id, (_, _, _, ai_score, ai_reasoning) in zip(resume_ids, rows)
+                    if ai_score is not None
+                ])
+                cursor.execute("COMMIT")
+                return resume_ids
+            except sqlite3.Error as e:
+                print(f"Error inserting resume batch: {e}")
+            finally:
+                _rollback_if_open(conn)
     return None
 
 def get_resume_by_id(resume_id):
     """Fetches a resume by its ID."""
-    conn = create_connection()
+    conn = get_connection()
     if conn:
+        with _db_lock:
+            try:
+                cursor = conn.cursor()
+                cursor.execute("SELECT * FROM resumes WHERE id = ?", (resume_id,))
+                row = cursor.fetchone()
+                if row:
+                    # Convert JSON strings back to lists/dicts
+                    cols = [description[0] for description in cursor.description]
+                    resume_dict = dict(zip(cols, row))
+                    if 'skills' in resume_dict and resume_dict['skills']:
+                        resume_dict['skills'] = orjson.loads(resume_dict['skills'])
+                    if 'experience' in resume_dict and resume_dict['experience']:
+                        resume_dict['experience'] = orjson.loads(resume_dict['experience'])
+                    if 'education' in resume_dict and resume_dict['education']:
+                        resume_dict['education'] = orjson.loads(resume_dict['education'])
+                    resume_dict['embedding'] = _blob_to_embedding(resume_dict.get('embedding'))
+                    return resume_dict
+            except sqlite3.Error as e:
+                print(f"Error fetching resume: {e}")
+    return None
+
+def get_embeddings_for_ids(resume_ids, embedding_model):
+    """
+    Fetches the stored SBERT embeddings for a list of resume IDs.
+    Only embeddings produced by embedding_model count: vectors from another model or backend (or stored
+    before the model was recorded) are not comparable with it, so those resumes are left out like ones without.
+    Returns (found_ids, embeddings): the IDs that have an embedding, in the requested order,
+    and an (len(found_ids), dim) float32 array stacking them, so scoring them against a JD is one matmul.
+    """
+    conn = get_connection()
+    rows = {}
+    if conn and resume_ids:
+        with _db_lock:
+            try:
+                cursor = conn.cursor()
+                placeholders = ", ".join("?" for _ in resume_ids)
+                cursor.execute(f"""
+                    SELECT id, embedding FROM resumes
+                    WHERE embedding IS NOT NULL AND embedding_model = ? AND id IN ({placeholders})
+                """, [embedding_model, *resume_ids])
+                rows = {resume_id: _blob_to_embedding(blob) for resume_id, blob in cursor.fetchall()}
+            except sqlite3.Error as e:
+                print(f"Error fetching embeddings: {e}")
+    found_ids = [resume_id for resume_id in resume_ids if resume_id in rows]
+    if not found_ids:
+        return [], np.zeros((0, 0), dtype=np.float32)
+    return found_ids, np.vstack([rows[resume_id] for resume_id in found_ids])
+
+def get_cached_resumes(content_hashes, parser_version, embedding_model):
+    """
+    Looks up cached parse results for the given resume text hashes.
+    Returns a dict mapping each cached hash to (parsed_data, embedding). Rows parsed by another parser_version
+    are left out; embedding is None if not computed yet or computed by another embedding_model.
+    """
+    conn = get_connection()
+    cached = {}
+    if conn and content_hashes:
+        with _db_lock:
+            try:
+                cursor = conn.cursor()
+                placeholders = ", ".join("?" for _ in content_hashes)
+                cursor.execute(f"""
+                    SELECT content_sha256, parsed_json, embedding, embedding_model FROM resume_cache
+                    WHERE parser_version = ? AND content_sha256 IN ({placeholders})
+                """, [parser_version, *content_hashes])
+                for content_hash, parsed_json, embedding, row_embedding_model in cursor.fetchall():
+                    cached[content_hash] = (
+                        orjson.loads(parsed_json),
+                        _blob_to_embedding(embedding) if row_embedding_model == embedding_model else None
+                    )
+            except sqlite3.Error as e:
+                print(f"Error reading resume cache: {e}")
+    return cached
+
+def cache_resumes(rows, parser_version, embedding_model):
+    """
+    Stores parse results in the resume cache, replacing existing entries.
+    rows is a list of (content_hash, parsed_data, embedding) tuples; embedding may be None.
+    parser_version and embedding_model identify what produced them (see get_cached_resumes).
+    """
+    conn = get_connection()
+    if conn and rows:
+        # Parameters are serialized before the transaction starts, so a serialization error cannot interrupt it
         try:
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM resumes WHERE id = ?", (resume_id,))
-            row = cursor.fetchone()
-            if row:
-                # Convert JSON strings back to lists/dicts
-                cols = [description[0] for description in cursor.description]
-                resume_dict = dict(zip(cols, row))
-                if 'skills' in resume_dict and resume_dict['skills']:
-                    resume_dict['skills'] = json.loads(resume_dict['skills'])
-                if 'experience' in resume_dict and resume_dict['experience']:
-                    resume_dict['experience'] = json.loads(resume_dict['experience'])
-                if 'education' in resume_dict and resume_dict['education']:
-                    resume_dict['education'] = json.loads(resume_dict['education'])
-                return resume_dict
-        except sqlite3.Error as e:
-            print(f"Error fetching resume: {e}")
-        finally:
-            conn.close()
+            cache_params = [
+                (content_hash, orjson.dumps(parsed_data).decode('utf-8'), _embedding_to_blob(embedding),
+                 parser_version, embedding_model)
+                for content_hash, parsed_data, embedding in rows
+            ]
+        except orjson.JSONEncodeError as e: # e.g. lone surrogates, which stdlib json accepted but orjson rejects
+            print(f"Error serializing resume cache entries: {e}")
+            return False
+        with _db_lock:
+            try:
+                cursor = conn.cursor()
+                cursor.execute("BEGIN IMMEDIATE")
+                cursor.executemany("""
+                    INSERT OR REPLACE INTO resume_cache (content_sha256, parsed_json, embedding, parser_version, embedding_model)
+                    VALUES (?, ?, ?, ?, ?)
+                """, cache_params)
+                cursor.execute("COMMIT")
+                return True
+            except sqlite3.Error as e:
+                print(f"Error writing resume cache: {e}")
+            finally:
+                _rollback_if_open(conn)
+    return False
+
+def get_cached_jd_embedding(content_hash, embedding_model):
+    """Returns the cached embedding for a job description hash, or None if absent or made by another embedding_model."""
+    conn = get_connection()
+    if conn:
+        with _db_lock:
+            try:
+                cursor = conn.cursor()
+                cursor.execute("SELECT embedding FROM jd_cache WHERE content_sha256 = ? AND embedding_model = ?",
+                               (content_hash, embedding_model))
+                row = cursor.fetchone()
+                if row:
+                    return _blob_to_embedding(row[0])
+            except sqlite3.Error as e:
+                print(f"Error reading JD cache: {e}")
     return None
 
+def cache_jd_embedding(content_hash, embedding, embedding_model):
+    """Stores the embedding for a job description hash, along with the model/backend that produced it."""
+    conn = get_connection()
+    if conn:
+        with _db_lock:
+            try:
+                cursor = conn.cursor()
+                cursor.execute("INSERT OR REPLACE INTO jd_cache (content_sha256, embedding, embedding_model) VALUES (?, ?, ?)",
+                               (content_hash, _embedding_to_blob(embedding), embedding_model))
+                return True
+            except sqlite3.Error as e:
+                print(f"Error writing JD cache: {e}")
+    return False
+
 def update_screening_feedback(result_id, human_score, human_comment):
     """Updates a screening result with human feedback."""
-    conn = create_connection()
+    conn = get_connection()
     if conn:
-        try:
-            cursor = conn.cursor()
-            cursor.execute("""
-                UPDATE screening_results
-                SET human_feedback_score = ?, human_feedback_comment = ?
-                WHERE id = ?
-            """, (human_score, human_comment, result_id))
-            conn.commit()
-            return True
-        except sqlite3.Error as e:
-            print(f"Error updating feedback: {e}")
-        finally:
-            conn.close()
+        with _db_lock:
+            try:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    UPDATE screening_results
+                    SET human_feedback_score = ?, human_feedback_comment = ?
+                    WHERE id = ?
+                """, (human_score, human_comment, result_id))
+                return True
+            except sqlite3.Error as e:
+                print(f"Error updating feedback: {e}")
     return False
 
 if __name__ == '__main__':
@@ -176,4 +430,4 @@ if __name__ == '__main__':
     # fetched_resume = get_resume_by_id(resume_id)
     # if fetched_resume:
     #     print("\nFetched Resume:")
-    #     print(json.dumps(fetched_resume, indent=4))
\ No newline at end of file
+    #     print(orjson.dumps(fetched_resume, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY).decode('utf-8'))
\ No newline at end of file
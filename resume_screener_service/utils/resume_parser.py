@@ -3,14 +3,68 @@
 import spacy
 import re
 import os
+import threading
+import fitz # PyMuPDF
+import docx # python-docx
 
-# Load SpaCy model once globally to avoid reloading for each request
-try:
-    nlp = spacy.load("en_core_web_sm")
-except OSError:
-    print("SpaCy model 'en_core_web_sm' not found. Downloading...")
-    spacy.cli.download("en_core_web_sm")
-    nlp = spacy.load("en_core_web_sm")
+# Only the NER component (PERSON entities for the name) is used; the remaining components are disabled
+# as the parser and tagger account for most of the pipeline's run time.
+SPACY_DISABLED_PIPES = ["parser", "tagger", "lemmatizer", "attribute_ruler"]
+_nlp = None
+_nlp_lock = threading.Lock()
+
+def get_nlp():
+    """
+    Returns the SpaCy model, loading it once on first use rather than at import,
+    so processes that import this module without parsing (e.g. scoring workers) never load it.
+    """
+    global _nlp
+    with _nlp_lock:
+        if _nlp is None:
+            try:
+                _nlp = spacy.load("en_core_web_sm", disable=SPACY_DISABLED_PIPES)
+            except OSError:
+                print("SpaCy model 'en_core_web_sm' not found. Downloading...")
+                spacy.cli.download("en_core_web_sm")
+                _nlp = spacy.load("en_core_web_sm", disable=SPACY_DISABLED_PIPES)
+    return _nlp
+
+def _clean_text(text: str) -> str:
+    """
+    Replaces lone UTF-16 surrogates (PyMuPDF can return them for broken PDF fonts) with '?'.
+    They are not valid UTF-8, and orjson refuses to serialize them.
+    """
+    return text.encode('utf-8', 'replace').decode('utf-8')
+
+# Stored with cached parse results; bump it whenever parse_resume_info output changes,
+# so results cached by an older parser are parsed again instead of being served stale
+PARSER_VERSION = 1
+
+def extract_text_from_stream(file_obj, ext: str) -> str:
+    """
+    Extracts text from an in-memory resume file (PDF, DOCX or TXT), such as an uploaded file's stream.
+    ext is the file extension including the dot (e.g. ".pdf").
+    Returns an empty string if the type is unsupported or the file cannot be read.
+    """
+    ext = ext.lower()
+    try:
+        if ext == '.pdf':
+            with fitz.open(stream=file_obj.read(), filetype="pdf") as pdf:
+                return _clean_text("\n".join(page.get_text() for page in pdf))
+        if ext == '.docx':
+            document = docx.Document(file_obj)
+            return _clean_text("\n".join(paragraph.text for paragraph in document.paragraphs))
+        if ext == '.txt':
+            return file_obj.read().decode('utf-8', errors='ignore')
+        print(f"Unsupported resume file type: {ext}")
+    except Exception as e:
+        print(f"Error extracting text from {ext} file: {e}")
+    return ""
+
+def extract_text_from_file(file_path: str) -> str:
+    """Extracts text from a resume file on disk (PDF, DOCX or TXT)."""
+    with open(file_path, 'rb') as f:
+        return extract_text_from_stream(f, os.path.splitext(file_path)[1])
 
 # Load common skills from file
 def load_common_skills(file_path):
@@ -18,23 +72,87 @@ def load_common_skills(file_path):
     try:
         with open(file_path, 'r', encoding='utf-8') as f:
             for line in f:
-                skills.add(line.strip().lower())
+                skill = line.strip().lower()
+                if skill: # Blank lines would otherwise become an empty "skill"
+                    skills.add(skill)
     except FileNotFoundError:
         print(f"Skills file not found: {file_path}. Please create it.")
     return list(skills)
 
 COMMON_SKILLS_FILE = os.path.join(os.path.dirname(__file__), '../data/common_skills.txt')
-KNOWN_SKILLS = load_common_skills(COMMON_SKILLS_FILE)
-# Sort by length descending to match longer phrases first (e.g., "Machine Learning" before "Learning")
-KNOWN_SKILLS.sort(key=len, reverse=True)
+# Lowercased once here; everything below compares against lowercased text
+KNOWN_SKILLS_LOWER = frozenset(load_common_skills(COMMON_SKILLS_FILE))
+# Sort by length descending to match longer phrases first (e.g., "Machine Learning" before "Learning"),
+# then alphabetically so the order is the same on every run
+KNOWN_SKILLS = sorted(KNOWN_SKILLS_LOWER, key=lambda skill: (-len(skill), skill))
+
+# Compile all patterns once at import time instead of on every parse_resume_info call.
+# Patterns applied to the lowercased resume text need no re.IGNORECASE.
+# A single alternation over all known skills lets the regex engine find every skill in one pass over the text.
+# Alternatives are tried longest-first (KNOWN_SKILLS is sorted) and must not be part of a larger word,
+# so "Java" is no longer found inside "JavaScript" nor "Git" inside "digital".
+_SKILLS_RE = re.compile(
+    r'(?<!\w)(?:' + '|'.join(re.escape(skill) for skill in KNOWN_SKILLS) + r')(?!\w)'
+) if KNOWN_SKILLS else None
+_EMAIL_RE = re.compile(r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}')
+# Non-capturing: the number is cleaned by dropping everything but the digits of the whole match
+_PHONE_RE = re.compile(r'(?:\+?\d{1,3})?[-. (]*\d{3}[-. )]*\d{3}[-. ]*\d{4}(?: *x\d+)?') # More generic
+_NON_DIGITS_RE = re.compile(r'\D')
+_YEARS_EXP_RE = re.compile(r'(\d+)\s*(?:years|yrs?)\s+(?:of)?\s*(?:experience|exp|background)')
+_DEGREE_RE = re.compile(r'(?:b\.?\s?s|m\.?\s?s|b\.?\s?a|ph\.?\s?d|bachelor|master|doctor|eng\.)[^.\n]*?(?:in|of)\s+([a-zA-Z\s]+)')
+_UNIVERSITY_RE = re.compile(r'(?:university|institute|college|school)\s+of\s+([a-zA-Z\s]+)|([a-zA-Z\s]+(?:university|institute|college))')
+_YEAR_RE = re.compile(r'\b(?:19|20)\d{2}\b') # Basic year
+
+EDUCATION_KEYWORDS = ["education", "academic background", "qualifications"]
+# Section text runs from the first heading keyword up to the next blank line, but never past this many characters
+SECTION_MAX_CHARS = 1000
+_TEN_DIGITS_RE = re.compile(r'\d{10}')
+
+def _find_section(text_lower: str, keywords: list):
+    """
+    Returns the section of text_lower starting at the first of the heading keywords, in list order, that occurs
+    in it, or None. Keywords are tried by priority rather than position, so a "Summary of Qualifications"
+    above the Education heading does not shadow it.
+    The section is located with str.find and a bounded slice, so it costs no regex backtracking on long resumes.
+    """
+    for keyword in keywords:
+        start = text_lower.find(keyword)
+        if start != -1:
+            break
+    else:
+        return None
+    section = text_lower[start:start + SECTION_MAX_CHARS]
+    # Whitespace right after the heading (e.g. "Education:\n\n") does not end the section
+    body_start = len(keyword) + len(section[len(keyword):]) - len(section[len(keyword):].lstrip())
+    end = section.find('\n\n', body_start)
+    return section if end == -1 else section[:end + 2]
 
+# The name is always near the top of a resume, so NER only ever looks at this many characters
+NAME_SEARCH_CHARS = 500
 
-def parse_resume_info(resume_text: str) -> dict:
+
+def _top_lines(resume_text: str) -> list:
+    """Returns the first few non-empty lines of a resume, where the name usually is."""
+    lines = [line.strip() for line in resume_text[:NAME_SEARCH_CHARS].split('\n') if line.strip()]
+    return lines[:3]
+
+def _guess_name_from_lines(resume_text: str):
+    """
+    Cheap name heuristic tried before spaCy: a top line of 2-4 words with no digits and no '@'.
+    Returns None if no line looks like a name.
+    """
+    for line in _top_lines(resume_text):
+        if 2 <= len(line.split()) <= 4 and '@' not in line and not any(c.isdigit() for c in line):
+            return line
+    return None
+
+
+def parse_resume_info(resume_text: str, doc=None) -> dict:
     """
     Parses a resume's text to extract key information.
     This is a rule-based approach and may require fine-tuning.
+    doc is an optional spaCy Doc for the first NAME_SEARCH_CHARS of resume_text (see parse_resumes_info).
     """
-    doc = nlp(resume_text)
     extracted_data = {
         "name": None,
         "email": None,
@@ -44,68 +162,54 @@ def parse_resume_info(resume_text: str) -> dict:
         "education": [],
         "raw_text": resume_text # Store raw text for later use if needed
     }
+    text_lower = resume_text.lower() # Lowercased once, shared by all the matching below
 
     # --- 1. Extract Name (Heuristic) ---
-    # Often, the name is the first non-email/phone entity, or the first prominent PERSON entity
+    # Often, the name is the first or second line, so try that before paying for spaCy NER.
     # This is highly heuristic and can fail. A more robust solution might involve training a custom NER.
-    name_candidates = []
-    for ent in doc.ents:
-        if ent.label_ == "PERSON" and len(ent.text.split()) >= 2: # At least two words for a name
-            name_candidates.append(ent.text)
-            break # Take the first person found
-
-    if name_candidates:
-        extracted_data['name'] = name_candidates[0]
-    else: # Fallback: Try to guess from the first non-empty line
-        lines = [line.strip() for line in resume_text.split('\n') if line.strip()]
-        if lines:
-            # Simple heuristic: often the first or second line is the name
-            # Avoid lines that look like emails, phones, or common job titles
-            for line in lines[:3]: # Check first few lines
-                if '@' not in line and not re.search(r'\d{10}', line) and len(line.split()) < 5:
-                    extracted_data['name'] = line
-                    break
+    extracted_data['name'] = _guess_name_from_lines(resume_text)
+
+    if extracted_data['name'] is None:
+        # Fall back to the first prominent PERSON entity near the top of the resume
+        if doc is None:
+            doc = get_nlp()(resume_text[:NAME_SEARCH_CHARS])
+        for ent in doc.ents:
+            if ent.label_ == "PERSON" and len(ent.text.split()) >= 2: # At least two words for a name
+                extracted_data['name'] = ent.text
+                break # Take the first person found
+
+    if extracted_data['name'] is None: # Last resort: any short top line
+        # Avoid lines that look like emails, phones, or common job titles
+        for line in _top_lines(resume_text):
+            if '@' not in line and not _TEN_DIGITS_RE.search(line) and len(line.split()) < 5:
+                extracted_data['name'] = line
+                break
 
 
     # --- 2. Extract Email & Phone ---
-    email_pattern = r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}'
-    phone_pattern = r'(?:\+?(\d{1,3}))?[-. (]*(\d{3})[-. )]*(\d{3})[-. ]*(\d{4})(?: *x(\d+))?' # More generic
-    
-    emails = re.findall(email_pattern, resume_text)
+    emails = _EMAIL_RE.findall(resume_text)
     if emails:
         extracted_data['email'] = emails[0]
 
-    phones = re.findall(phone_pattern, resume_text)
-    if phones:
+    phone_match = _PHONE_RE.search(resume_text)
+    if phone_match:
         # Reconstruct phone number to a clean format
-        extracted_data['phone'] = ''.join(phones[0] if isinstance(phones[0], tuple) else phones[0])
+        extracted_data['phone'] = _NON_DIGITS_RE.sub('', phone_match.group(0))
 
 
     # --- 3. Extract Skills ---
-    # Using a predefined list and checking for presence, prioritize longer matches
+    # Using a predefined list and one compiled alternation, longer matches win
     found_skills = set()
-    text_lower = resume_text.lower()
-    for skill in KNOWN_SKILLS:
-        if skill.lower() in text_lower:
-            found_skills.add(skill)
+    if _SKILLS_RE:
+        found_skills = set(_SKILLS_RE.findall(text_lower))
     extracted_data['skills'] = list(found_skills)
 
     # --- 4. Extract Experience (Basic heuristic) ---
-    # Look for keywords and try to extract sections around them
-    experience_keywords = ["experience", "work history", "employment", "professional background"]
-    experience_section = ""
-    for keyword in experience_keywords:
-        if keyword in text_lower:
-            # Try to find the section by looking for common headings
-            match = re.search(r'(?:' + keyword + r')\s*(.*?)(\n\n|$)', text_lower, re.IGNORECASE | re.DOTALL)
-            if match:
-                experience_section = match.group(0) # Get the matched section including keyword
-                break
-    
     # Refine experience section extraction
     # This is notoriously hard without custom NER or more advanced parsing
-    # For now, we'll just capture general "experience years" if found
-    years_experience_match = re.search(r'(\d+)\s*(?:years|yrs?)\s+(?:of)?\s*(?:experience|exp|background)', text_lower, re.IGNORECASE)
+    # For now, we'll just capture general "experience years" if found.
+    # The whole text is searched: "5 years of experience" is usually in the summary, above the experience heading.
+    years_experience_match = _YEARS_EXP_RE.search(text_lower)
     if years_experience_match:
         extracted_data['experience'].append(f"{years_experience_match.group(1)} years experience")
     
@@ -115,36 +219,40 @@ def parse_resume_info(resume_text: str) -> dict:
     # For a basic MVP, years of experience or just keywords might suffice.
     
     # --- 5. Extract Education (Basic heuristic) ---
-    education_keywords = ["education", "academic background", "qualifications"]
-    for keyword in education_keywords:
-        if keyword in text_lower:
-            match = re.search(r'(?:' + keyword + r')\s*(.*?)(\n\n|$)', text_lower, re.IGNORECASE | re.DOTALL)
-            if match:
-                education_section_text = match.group(0)
-                # Now try to extract degree, university, year from this section
-                # Example patterns: "B.Tech in CS from XYZ University (2020)"
-                degree_pattern = r'(?:b\.?\s?s|m\.?\s?s|b\.?\s?a|ph\.?\s?d|bachelor|master|doctor|eng\.)[^.\n]*?(?:in|of)\s+([a-zA-Z\s]+)'
-                university_pattern = r'(?:university|institute|college|school)\s+of\s+([a-zA-Z\s]+)|([a-zA-Z\s]+(?:university|institute|college))'
-                year_pattern = r'\b(?:19|20)\d{2}\b' # Basic year
-                
-                degrees = re.findall(degree_pattern, education_section_text, re.IGNORECASE)
-                universities = re.findall(university_pattern, education_section_text, re.IGNORECASE)
-                years = re.findall(year_pattern, education_section_text)
-
-                if degrees:
-                    # Clean up degree match, take first group
-                    deg = degrees[0] if isinstance(degrees[0], str) else (degrees[0][0] or degrees[0][1])
-                    extracted_data['education'].append(f"Degree: {deg.strip()}")
-                if universities:
-                    # Clean up university match, take first non-empty group
-                    uni = universities[0] if isinstance(universities[0], str) else (universities[0][0] or universities[0][1])
-                    extracted_data['education'].append(f"University: {uni.strip()}")
-                if years:
-                    extracted_data['education'].append(f"Year: {years[0]}")
-                break
+    education_section_text = _find_section(text_lower, EDUCATION_KEYWORDS)
+    if education_section_text:
+        # Now try to extract degree, university, year from this section
+        # Example patterns: "B.Tech in CS from XYZ University (2020)"
+        degrees = _DEGREE_RE.findall(education_section_text)
+        universities = _UNIVERSITY_RE.findall(education_section_text)
+        years = _YEAR_RE.findall(education_section_text)
+
+        if degrees:
+            # Clean up degree match, take first group
+            deg = degrees[0] if isinstance(degrees[0], str) else (degrees[0][0] or degrees[0][1])
+            extracted_data['education'].append(f"Degree: {deg.strip()}")
+        if universities:
+            # Clean up university match, take first non-empty group
+            uni = universities[0] if isinstance(universities[0], str) else (universities[0][0] or universities[0][1])
+            extracted_data['education'].append(f"University: {uni.strip()}")
+        if years:
+            extracted_data['education'].append(f"Year: {years[0]}")
 
     return extracted_data
 
+def parse_resumes_info(resume_texts: list) -> list:
+    """
+    Parses several resumes at once, in the same order as resume_texts.
+    Resumes whose name the line heuristic cannot find go through spaCy together with nlp.pipe,
+    which processes them in batches instead of making one nlp() call per resume.
+    """
+    needs_ner = [i for i, text in enumerate(resume_texts) if _guess_name_from_lines(text) is None]
+    docs = {}
+    if needs_ner:
+        docs = dict(zip(needs_ner, get_nlp().pipe((resume_texts[i][:NAME_SEARCH_CHARS] for i in needs_ner),
+                                                  batch_size=32, n_process=1)))
+    return [parse_resume_info(text, docs.get(i)) for i, text in enumerate(resume_texts)]
+
 if __name__ == '__main__':
     # Test the full parsing
     dummy_resume_path = '../data/dummy_resume.txt'
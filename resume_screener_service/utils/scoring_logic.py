@@ -1,23 +1,113 @@
 # resume_screener_service/utils/scoring_logic.py
 
-from sentence_transformers import SentenceTransformer, util
-import spacy
+from sentence_transformers import SentenceTransformer
+from numba import njit
+import numpy as np
+import torch
+import ahocorasick # pyahocorasick
+import os
 import re
-from typing import List, Dict
+import functools
+import multiprocessing
+import queue
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import repeat
+from typing import List, Dict, NamedTuple, Optional, Tuple
 
-# Load SpaCy model for processing job descriptions (if not already loaded globally)
-try:
-    nlp_score = spacy.load("en_core_web_sm")
-except OSError:
-    print("SpaCy model 'en_core_web_sm' not found. Downloading...")
-    spacy.cli.download("en_core_web_sm")
-    nlp_score = spacy.load("en_core_web_sm")
-
-
-# Load SentenceTransformer model once globally for efficiency
 # 'all-MiniLM-L6-v2' is good balance of speed and accuracy for semantic similarity
 # 'all-mpnet-base-v2' is slightly better but larger
-model_sbert = SentenceTransformer('all-MiniLM-L6-v2')
+SBERT_MODEL_NAME = 'all-MiniLM-L6-v2'
+# The PyTorch model runs on the GPU when there is one, on the CPU otherwise
+SBERT_DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+# SBERT_BACKEND=onnx-int8 runs the model through ONNX Runtime with dynamically quantized INT8 weights (CPU);
+# SBERT_BACKEND=torch runs the original PyTorch model on SBERT_DEVICE (in BF16 where supported, see _load_torch_model).
+# The default is torch with a GPU and onnx-int8 without one.
+SBERT_BACKEND = os.environ.get('SBERT_BACKEND', 'torch' if SBERT_DEVICE == "cuda" else 'onnx-int8').lower()
+# ONNX Runtime quantization target: "avx512_vnni", "avx512", "avx2" or "arm64"
+SBERT_QUANTIZATION_CONFIG = os.environ.get('SBERT_QUANTIZATION_CONFIG', 'avx512_vnni')
+# The quantized model is exported here on first start and loaded from here afterwards
+SBERT_ONNX_DIR = os.path.join(os.path.dirname(__file__), '../data/minilm-int8')
+
+def _supports_bf16(device: torch.device) -> bool:
+    """True if the device has native BF16 math (a CUDA GPU that supports it, or a CPU with AVX-512 BF16)."""
+    if device.type == 'cuda':
+        return torch.cuda.is_bf16_supported()
+    is_cpu_support_avx512_bf16 = getattr(torch.cpu, '_is_cpu_support_avx512_bf16', None) # Private, not in every release
+    return bool(is_cpu_support_avx512_bf16 and is_cpu_support_avx512_bf16())
+
+def _load_torch_model() -> SentenceTransformer:
+    """Loads the PyTorch model, with BF16 weights where the hardware runs BF16 natively and FP32 elsewhere."""
+    model = SentenceTransformer(SBERT_MODEL_NAME, device=SBERT_DEVICE)
+    if _supports_bf16(model.device):
+        model[0].auto_model = model[0].auto_model.to(torch.bfloat16)
+    return model
+
+def load_sbert_model() -> SentenceTransformer:
+    """
+    Loads the SentenceTransformer model for the configured SBERT_BACKEND.
+    Falls back to the PyTorch model if the ONNX export or load fails (e.g. optimum/onnxruntime not installed,
+    or sentence-transformers older than 3.2, which added the ONNX backend and its exporter).
+    """
+    if SBERT_BACKEND == 'torch':
+        return _load_torch_model()
+    if SBERT_BACKEND != 'onnx-int8':
+        raise ValueError(f"Unknown SBERT_BACKEND: {SBERT_BACKEND} (expected 'onnx-int8' or 'torch')")
+
+    quantized_file = f"onnx/model_qint8_{SBERT_QUANTIZATION_CONFIG}.onnx"
+    try:
+        # Imported here so that the torch backend keeps working on releases without the exporter
+        from sentence_transformers import export_dynamic_quantized_onnx_model
+        if not os.path.exists(os.path.join(SBERT_ONNX_DIR, quantized_file)):
+            print(f"Exporting INT8 ONNX model for '{SBERT_MODEL_NAME}' to {SBERT_ONNX_DIR}...")
+            onnx_model = SentenceTransformer(SBERT_MODEL_NAME, backend="onnx")
+            onnx_model.save(SBERT_ONNX_DIR) # Tokenizer and pooling config, needed to load from the directory
+            export_dynamic_quantized_onnx_model(onnx_model, SBERT_QUANTIZATION_CONFIG, SBERT_ONNX_DIR)
+        return SentenceTransformer(SBERT_ONNX_DIR, backend="onnx", model_kwargs={"file_name": quantized_file})
+    except Exception as e:
+        print(f"Could not load the INT8 ONNX model ({e}). Falling back to the PyTorch model.")
+        return _load_torch_model()
+
+# The SentenceTransformer model is loaded once, on first use rather than at import:
+# scoring worker processes import this module but never run the model
+_sbert_model = None
+_sbert_model_lock = threading.Lock()
+
+def get_sbert_model() -> SentenceTransformer:
+    """Returns the shared SentenceTransformer model, loading it on the first call."""
+    global _sbert_model
+    with _sbert_model_lock:
+        if _sbert_model is None:
+            _sbert_model = load_sbert_model()
+    return _sbert_model
+
+def embedding_model_id(sbert_model: SentenceTransformer) -> str:
+    """
+    Identifies the model, backend, precision and long-text windowing that produced an embedding
+    (e.g. 'all-MiniLM-L6-v2/onnx-qint8-avx512_vnni/windows-192').
+    Embeddings cached under another ID are not comparable with this model's and must be recomputed.
+    """
+    if getattr(sbert_model, 'backend', 'torch') == 'onnx':
+        variant = f"onnx-qint8-{SBERT_QUANTIZATION_CONFIG}"
+    else:
+        variant = f"torch-{str(next(sbert_model.parameters()).dtype).removeprefix('torch.')}"
+    # Resumes embedded before long texts were split into windows (see encode_long_texts) had no windows-
+    # suffix, so they are recomputed instead of keeping an embedding of only their first 256 tokens
+    return f"{SBERT_MODEL_NAME}/{variant}/windows-{LONG_TEXT_WINDOW_STRIDE}"
+
+# JD section patterns, compiled once at import time instead of on every _extract_jd_requirements call.
+# They run on the lowercased JD; the section patterns keep re.IGNORECASE because their "next heading" lookahead uses [A-Z].
+_SKILLS_RE = re.compile(r'(?:(?:required|key)\s+skills|skills|technical\s+qualifications):?\s*(.*?)(?:\n\n|\n[A-Z][a-zA-Z\s]+:|\Z)', re.IGNORECASE | re.DOTALL)
+_RESP_RE = re.compile(r'(?:key\s+responsibilities|responsibilities|duties):?\s*(.*?)(?:\n\n|\n[A-Z][a-zA-Z\s]+:|\Z)', re.IGNORECASE | re.DOTALL)
+_EXP_RE = re.compile(r'(\d+)\s*(?:\+|plus)?\s*(?:years|yrs?)\s+(?:of\s+)?(?:experience|exp)')
+_EDU_RE = re.compile(r'(?:education|qualifications|academic\s+background):?\s*(.*?)(?:\n\n|\n[A-Z][a-zA-Z\s]+:|\Z)', re.IGNORECASE | re.DOTALL)
+# Years of experience claimed in a resume: "5 years", "5+ years", "5 yrs", "1 year"
+_EXP_YEARS_RE = re.compile(r'(?<!\d)(\d{1,2})\s*\+?\s*(?:years?|yrs?)\b', re.IGNORECASE)
+# Deletes bullet characters in one pass over the text (str.translate) instead of one replace() per character
+_BULLET_STRIP = str.maketrans('', '', '*-•')
+# Maps the list separators ';' and newline to ',', so a plain str.split(',') splits on all three without the regex engine
+_SPLIT_TRANS = str.maketrans({';': ',', '\n': ','})
 
 def _extract_jd_requirements(jd_text: str) -> Dict[str, List[str]]:
     """
@@ -37,139 +127,492 @@ def _extract_jd_requirements(jd_text: str) -> Dict[str, List[str]]:
     # Extract skills (simple keyword matching, can be improved with NER)
     # This assumes skills are often listed explicitly.
     # For a robust solution, you'd match against your KNOWN_SKILLS list.
-    skills_match = re.search(r'(?:(?:required|key)\s+skills|skills|technical\s+qualifications):?\s*(.*?)(?:\n\n|\n[A-Z][a-zA-Z\s]+:|\Z)', jd_lower, re.IGNORECASE | re.DOTALL)
+    skills_match = _SKILLS_RE.search(jd_lower)
     if skills_match:
-        skills_text = skills_match.group(1).replace('*', '').replace('-', '').replace('•', '').strip()
-        requirements['skills'] = [s.strip() for s in re.split(r'[,;\n]', skills_text) if s.strip()]
+        skills_text = skills_match.group(1).translate(_BULLET_STRIP).strip()
+        # dict.fromkeys drops repeated skills (the text is already lowercased) while keeping their order
+        requirements['skills'] = list(dict.fromkeys(s.strip() for s in skills_text.translate(_SPLIT_TRANS).split(',') if s.strip()))
     
     # Extract responsibilities
-    responsibilities_match = re.search(r'(?:key\s+responsibilities|responsibilities|duties):?\s*(.*?)(?:\n\n|\n[A-Z][a-zA-Z\s]+:|\Z)', jd_lower, re.IGNORECASE | re.DOTALL)
+    responsibilities_match = _RESP_RE.search(jd_lower)
     if responsibilities_match:
-        responsibilities_text = responsibilities_match.group(1).replace('*', '').replace('-', '').replace('•', '').strip()
-        requirements['responsibilities'] = [r.strip() for r in re.split(r'[,;\n]', responsibilities_text) if r.strip()]
+        responsibilities_text = responsibilities_match.group(1).translate(_BULLET_STRIP).strip()
+        requirements['responsibilities'] = [r.strip() for r in responsibilities_text.translate(_SPLIT_TRANS).split(',') if r.strip()]
 
     # Extract experience years
-    exp_match = re.search(r'(\d+)\s*(?:\+|plus)?\s*(?:years|yrs?)\s+(?:of\s+)?(?:experience|exp)', jd_lower, re.IGNORECASE)
+    exp_match = _EXP_RE.search(jd_lower)
     if exp_match:
         requirements['experience_years'] = int(exp_match.group(1))
     
     # Extract education
-    edu_match = re.search(r'(?:education|qualifications|academic\s+background):?\s*(.*?)(?:\n\n|\n[A-Z][a-zA-Z\s]+:|\Z)', jd_lower, re.IGNORECASE | re.DOTALL)
+    edu_match = _EDU_RE.search(jd_lower)
     if edu_match:
-        edu_text = edu_match.group(1).replace('*', '').replace('-', '').replace('•', '').strip()
-        requirements['education'] = [e.strip() for e in re.split(r'[,;\n]', edu_text) if e.strip()]
+        edu_text = edu_match.group(1).translate(_BULLET_STRIP).strip()
+        requirements['education'] = [e.strip() for e in edu_text.translate(_SPLIT_TRANS).split(',') if e.strip()]
 
     return requirements
 
-def score_resume(parsed_resume_data: Dict, job_description_text: str, sbert_model: SentenceTransformer) -> (float, str):
+# Weights of the four score components, in the order returned by _score_components:
+# skills 40%, experience years 30%, responsibility alignment 20%, education 10%
+SCORE_WEIGHTS = np.array([0.40, 0.30, 0.20, 0.10])
+
+# Shared embedding worker: concurrent requests put (text, Future) pairs on the queue and a single
+# thread encodes whatever has accumulated in one batch, instead of every Flask thread running the model
+EMBED_BATCH_SIZE = 64 # Max texts per encode() call
+EMBED_BATCH_WAIT_SECONDS = 0.005 # How long the worker waits for more texts before encoding a partial batch
+_embed_queue = queue.Queue()
+_embed_worker_thread = None
+_embed_worker_lock = threading.Lock()
+
+def _encode_now(texts: List[str], sbert_model: SentenceTransformer) -> np.ndarray:
+    # No autograd bookkeeping (version counters, grad tracking) for the PyTorch backend
+    with torch.inference_mode():
+        embeddings = sbert_model.encode(texts, batch_size=EMBED_BATCH_SIZE, convert_to_tensor=True,
+                                        normalize_embeddings=True, show_progress_bar=False)
+    # Embeddings stay on the model's device until here, so there is one device-to-host copy (and sync)
+    # for the whole call; convert_to_numpy would copy each batch back as soon as it is encoded
+    return embeddings.float().cpu().numpy()
+
+def _drain_embed_queue() -> Tuple[List[str], List[Future]]:
+    """Blocks for the next queued text, then collects more until the batch is full or the wait runs out."""
+    text, future = _embed_queue.get()
+    texts, futures = [text], [future]
+    while len(texts) < EMBED_BATCH_SIZE:
+        try:
+            text, future = _embed_queue.get(timeout=EMBED_BATCH_WAIT_SECONDS)
+        except queue.Empty:
+            break
+        texts.append(text)
+        futures.append(future)
+    return texts, futures
+
+def _embed_worker():
+    while True:
+        texts, futures = _drain_embed_queue()
+        try:
+            embeddings = _encode_now(texts, get_sbert_model())
+        except Exception as e:
+            for future in futures:
+                future.set_exception(e)
+            continue
+        for future, embedding in zip(futures, embeddings):
+            future.set_result(embedding)
+
+def start_embed_worker():
+    """
+    Starts the background thread that services encode_texts calls made with the get_sbert_model() model.
+    Safe to call more than once; until it is called, encode_texts runs the model in the calling thread.
+    """
+    global _embed_worker_thread
+    with _embed_worker_lock:
+        if _embed_worker_thread is None or not _embed_worker_thread.is_alive():
+            _embed_worker_thread = threading.Thread(target=_embed_worker, name="embed-worker", daemon=True)
+            _embed_worker_thread.start()
+
+def encode_texts(texts: List[str], sbert_model: SentenceTransformer) -> np.ndarray:
+    """
+    Encodes a list of texts in a single batched forward pass.
+    SentenceTransformer.encode sorts the inputs by length before batching ("smart batching"),
+    so each batch is only padded to its own longest text. Embeddings are L2-normalized,
+    which makes cosine similarity a plain dot product.
+    With the embed worker running, texts for the get_sbert_model() model are queued and batched together
+    with those of other concurrent requests.
+    """
+    if sbert_model is not _sbert_model or _embed_worker_thread is None or not texts:
+        return _encode_now(texts, sbert_model)
+    futures = []
+    for text in texts:
+        future = Future()
+        _embed_queue.put((text, future))
+        futures.append(future)
+    return np.vstack([future.result() for future in futures])
+
+# Resume texts longer than the model's max sequence length (which it would silently truncate) are split into
+# overlapping token windows this many tokens apart; each window is embedded and the embeddings are max-pooled
+LONG_TEXT_WINDOW_STRIDE = 192
+
+def _text_windows(text: str, sbert_model: SentenceTransformer) -> List[str]:
+    """Splits text into overlapping windows that each fit the model's max sequence length. Short texts are returned as is."""
+    window_tokens = sbert_model.max_seq_length - 2 # Room for the [CLS] and [SEP] special tokens
+    tokens = sbert_model.tokenizer.tokenize(text)
+    if len(tokens) <= window_tokens:
+        return [text]
+    stride = min(LONG_TEXT_WINDOW_STRIDE, window_tokens)
+    return [sbert_model.tokenizer.convert_tokens_to_string(tokens[start:start + window_tokens])
+            for start in range(0, len(tokens) - window_tokens + stride, stride)]
+
+def encode_long_texts(texts: List[str], sbert_model: SentenceTransformer) -> np.ndarray:
+    """
+    Like encode_texts, but texts longer than the model's max sequence length are embedded window by window
+    (see _text_windows) and max-pooled, instead of only their beginning being seen by the model.
+    The windows of all texts are encoded in one batch; the pooled embeddings are L2-normalized again.
+    """
+    windows, offsets = [], []
+    for text in texts:
+        offsets.append(len(windows))
+        windows.extend(_text_windows(text, sbert_model))
+    if len(windows) == len(texts): # Every text fits in a single window
+        return encode_texts(texts, sbert_model)
+
+    pooled = np.maximum.reduceat(encode_texts(windows, sbert_model), offsets, axis=0)
+    norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+    return pooled / np.maximum(norms, 1e-12)
+
+def _keyword_automaton(keywords: List[str]) -> ahocorasick.Automaton:
+    """
+    Builds an Aho-Corasick automaton over the lowercased keywords, so a text can be checked
+    for all of them in a single pass instead of one substring search per keyword.
+    """
+    automaton = ahocorasick.Automaton()
+    for keyword in keywords:
+        automaton.add_word(keyword.lower(), keyword)
+    automaton.make_automaton()
+    return automaton
+
+# Cosine similarity above which a resume skill counts as a match for a JD skill
+SKILL_MATCH_THRESHOLD = 0.6
+
+@njit(cache=True, fastmath=True)
+def _count_skill_matches(jd_embeddings, resume_embeddings, threshold):
+    """
+    Counts the rows of jd_embeddings whose best dot product with a row of resume_embeddings is above threshold.
+    Compiled with Numba: the dot products, row max and count run as one loop nest without building the
+    similarity matrix, and a JD skill stops being compared as soon as one resume skill matches it.
+    """
+    matched = 0
+    for i in range(jd_embeddings.shape[0]):
+        for j in range(resume_embeddings.shape[0]):
+            similarity = 0.0
+            for k in range(jd_embeddings.shape[1]):
+                similarity += jd_embeddings[i, k] * resume_embeddings[j, k]
+            if similarity > threshold:
+                matched += 1
+                break
+    return matched
+
+class JDContext(NamedTuple):
+    """The parts of a job description that are the same for every resume scored against it."""
+    requirements: Dict # Output of _extract_jd_requirements
+    skill_embeddings: Optional[np.ndarray] # One row per entry of requirements['skills'], None if there are none
+    education_automaton: Optional[ahocorasick.Automaton] # Over requirements['education'], None if there is none
+
+@functools.lru_cache(maxsize=128)
+def _prepare_jd(job_description_text: str, sbert_model: SentenceTransformer) -> JDContext:
+    """
+    Extracts the JD requirements, embeds the JD skills and builds the education
+    keyword automaton. The responsibilities embedding is left to _jd_resp_embedding, as callers often
+    have it cached already.
+    Cached per (JD text, model), so scoring N resumes against the same JD does this work once.
+    The returned context is shared between callers and must not be modified.
+    """
+    requirements = _extract_jd_requirements(job_description_text)
+    jd_required_skills = requirements.get('skills', [])
+    jd_required_education = requirements.get('education', [])
+
+    skill_embeddings = encode_texts(jd_required_skills, sbert_model) if jd_required_skills else None
+    education_automaton = _keyword_automaton(jd_required_education) if jd_required_education else None
+    return JDContext(requirements, skill_embeddings, education_automaton)
+
+@functools.lru_cache(maxsize=128)
+def _jd_resp_embedding(job_description_text: str, sbert_model: SentenceTransformer) -> Optional[np.ndarray]:
+    """
+    Embeds the joined JD responsibilities, or returns None if the JD lists none.
+    Only called when no cached embedding is passed in; cached per (JD text, model) like _prepare_jd.
+    """
+    jd_responsibilities = _prepare_jd(job_description_text, sbert_model).requirements.get('responsibilities', [])
+    if not jd_responsibilities:
+        return None
+    return encode_texts([" ".join(jd_responsibilities)], sbert_model)[0]
+
+def encode_resumes_for_scoring(parsed_resumes: List[Dict], job_description_text: str,
+                               sbert_model: SentenceTransformer,
+                               jd_resp_embedding: Optional[np.ndarray] = None,
+                               resume_embeddings: Optional[List[Optional[np.ndarray]]] = None
+                               ) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+    """
+    Embeds the raw text of every resume in one batched call; the JD responsibilities embedding
+    comes from _jd_resp_embedding, so N resumes cost one encode() instead of 2N.
+    jd_resp_embedding and resume_embeddings (one entry per resume, None where missing) may carry
+    cached embeddings; only the missing resume embeddings are encoded.
+    Returns (jd_resp_embedding, resume_embeddings), or (None, None) without running the model when
+    the JD lists no responsibilities and the responsibility match will not be computed anyway.
+    """
+    if not parsed_resumes:
+        return None, None
+    if jd_resp_embedding is None:
+        jd_resp_embedding = _jd_resp_embedding(job_description_text, sbert_model)
+        if jd_resp_embedding is None:
+            return None, None
+
+    resume_embeddings = list(resume_embeddings) if resume_embeddings is not None else [None] * len(parsed_resumes)
+    missing = [i for i, embedding in enumerate(resume_embeddings) if embedding is None]
+    # Resumes without text get no responsibility score (see _score_components), so they are not run
+    # through the model; a zero vector keeps their row in the output
+    for i in missing:
+        if not parsed_resumes[i].get('raw_text'):
+            resume_embeddings[i] = np.zeros_like(jd_resp_embedding)
+    missing = [i for i in missing if resume_embeddings[i] is None]
+    texts = [parsed_resumes[i]['raw_text'] for i in missing] # Raw text gives broader context than the summary alone
+
+    if texts:
+        embeddings = encode_long_texts(texts, sbert_model)
+        for i, embedding in zip(missing, embeddings):
+            resume_embeddings[i] = embedding
+    return jd_resp_embedding, np.vstack(resume_embeddings)
+
+def _canonical_skills(skills: List[str]) -> List[str]:
+    """Stripped, lowercased and deduplicated (in order), so no skill is embedded twice."""
+    return list(dict.fromkeys(skill.strip().lower() for skill in skills if skill.strip()))
+
+def _embed_resume_skills(parsed_resumes: List[Dict], jd_context: JDContext,
+                         sbert_model: SentenceTransformer) -> List[Optional[np.ndarray]]:
+    """
+    Embeds the canonical skills (see _canonical_skills) of every resume that still has JD skills to compare
+    semantically after the verbatim match, in one encode() call over the distinct skills of all of them.
+    Returns one array per resume, with a row per canonical skill, or None where no embedding is needed.
+    """
+    jd_required_skills = set(jd_context.requirements.get('skills', []))
+    skill_lists = [_canonical_skills(parsed_resume_data.get('skills', [])) for parsed_resume_data in parsed_resumes]
+    needed = [bool(jd_required_skills and skills and not jd_required_skills.issubset(skills)) for skills in skill_lists]
+    distinct_skills = list(dict.fromkeys(skill for skills, need in zip(skill_lists, needed) if need for skill in skills))
+    if not distinct_skills:
+        return [None] * len(parsed_resumes)
+
+    embeddings = encode_texts(distinct_skills, sbert_model)
+    row_of = {skill: i for i, skill in enumerate(distinct_skills)}
+    return [embeddings[[row_of[skill] for skill in skills]] if need else None
+            for skills, need in zip(skill_lists, needed)]
+
+# Large batches can be scored on worker processes: the per-resume part of scoring (skill-match loop, regexes,
+# reasoning) is Python code that holds the GIL. All embeddings are computed here first, so the workers
+# load no model. Off by default (SCORING_WORKERS=1): scoring 64 resumes in-process takes under a millisecond,
+# less than one round trip to a warm pool, and spawned workers re-import the app's modules when they start.
+# Only raise it where a benchmark on the deployment's batch sizes shows a win.
+SCORING_WORKERS = int(os.environ.get('SCORING_WORKERS', 1))
+SCORING_PROCESS_MIN_BATCH = 32 # Smaller batches are not worth the pickling round trip
+_scoring_pool = None
+_scoring_pool_lock = threading.Lock()
+
+def _get_scoring_pool() -> ProcessPoolExecutor:
+    """
+    Returns the scoring process pool, creating it on first use. It lives for the life of the process,
+    so workers pay their import cost once. Workers are spawned, not forked, as this process runs
+    the embed worker and PyTorch threads.
+    """
+    global _scoring_pool
+    with _scoring_pool_lock:
+        if _scoring_pool is None:
+            _scoring_pool = ProcessPoolExecutor(max_workers=SCORING_WORKERS,
+                                                mp_context=multiprocessing.get_context("spawn"))
+        return _scoring_pool
+
+def _reset_scoring_pool(broken_pool: ProcessPoolExecutor):
+    """Drops a broken scoring pool (e.g. a worker was killed) so the next large batch starts a fresh one."""
+    global _scoring_pool
+    with _scoring_pool_lock:
+        if _scoring_pool is broken_pool:
+            _scoring_pool = None
+    broken_pool.shutdown(wait=False, cancel_futures=True)
+
+def _for_scoring_worker(parsed_resume_data: Dict) -> Dict:
+    """
+    Copy of a parsed resume to send to a scoring worker. The raw text is most of the pickle but scoring
+    only needs to know whether there is any, so it is replaced by a has_raw_text flag.
+    """
+    worker_data = {key: value for key, value in parsed_resume_data.items() if key != 'raw_text'}
+    worker_data['has_raw_text'] = bool(parsed_resume_data.get('raw_text'))
+    return worker_data
+
+def _score_chunk(jd_context: JDContext, parsed_resumes: List[Dict], similarities: List[Optional[float]],
+                 skill_embeddings: List[Optional[np.ndarray]]) -> List[Tuple[np.ndarray, str]]:
+    """Runs _score_components for a chunk of resumes against one JD context. Also the worker-process entry point."""
+    return [_score_components(parsed_resume_data, jd_context, similarity, resume_skill_embeddings)
+            for parsed_resume_data, similarity, resume_skill_embeddings
+            in zip(parsed_resumes, similarities, skill_embeddings)]
+
+def score_resumes_batch(parsed_resumes: List[Dict], job_description_text: str, sbert_model: SentenceTransformer,
+                        jd_resp_embedding: Optional[np.ndarray] = None,
+                        resume_embeddings: Optional[np.ndarray] = None) -> List[Tuple[float, str]]:
+    """
+    Scores many parsed resumes against one job description.
+    Returns a (score, reasoning) tuple per resume, in the same order as parsed_resumes.
+    jd_resp_embedding/resume_embeddings are the output of encode_resumes_for_scoring; they are
+    computed here when not passed in. Since the embeddings are normalized, the responsibility
+    similarity of every resume comes from a single matrix-vector product.
+    With SCORING_WORKERS > 1, batches of SCORING_PROCESS_MIN_BATCH resumes or more are split into one chunk
+    per scoring worker process; the JD context is sent once per chunk.
+    """
+    if jd_resp_embedding is None or resume_embeddings is None:
+        jd_resp_embedding, resume_embeddings = encode_resumes_for_scoring(parsed_resumes, job_description_text, sbert_model)
+
+    jd_context = _prepare_jd(job_description_text, sbert_model)
+    similarities = [None] * len(parsed_resumes)
+    if jd_resp_embedding is not None:
+        similarities = (resume_embeddings @ jd_resp_embedding).tolist()
+
+    skill_embeddings = _embed_resume_skills(parsed_resumes, jd_context, sbert_model)
+
+    scored = None
+    if SCORING_WORKERS > 1 and len(parsed_resumes) >= SCORING_PROCESS_MIN_BATCH:
+        chunk_size = -(-len(parsed_resumes) // SCORING_WORKERS)
+        starts = range(0, len(parsed_resumes), chunk_size)
+        pool = _get_scoring_pool()
+        try:
+            chunk_results = pool.map(_score_chunk, repeat(jd_context),
+                                     [[_for_scoring_worker(parsed_resume_data)
+                                       for parsed_resume_data in parsed_resumes[i:i + chunk_size]] for i in starts],
+                                     [similarities[i:i + chunk_size] for i in starts],
+                                     [skill_embeddings[i:i + chunk_size] for i in starts])
+            scored = [result for chunk in chunk_results for result in chunk]
+        except BrokenProcessPool as e:
+            print(f"Scoring worker pool broke ({e}); scoring this batch in-process.")
+            _reset_scoring_pool(pool)
+    if scored is None:
+        scored = _score_chunk(jd_context, parsed_resumes, similarities, skill_embeddings)
+    if not scored:
+        return []
+    components, reasonings = zip(*scored)
+
+    # Weighted sum for every resume at once: (N, 4) @ (4,)
+    total_scores = np.vstack(components) @ SCORE_WEIGHTS
+    return [(round(float(total_score), 2), reasoning) for total_score, reasoning in zip(total_scores, reasonings)]
+
+def score_resume(parsed_resume_data: Dict, job_description_text: str, sbert_model: SentenceTransformer,
+                 responsibility_similarity: Optional[float] = None) -> (float, str):
     """
     Scores a parsed resume against a job description.
     Returns a score (0-100) and a brief reasoning string.
+    responsibility_similarity is the precomputed cosine similarity between the JD responsibilities
+    and the resume's raw text (see score_resumes_batch); it is computed here when not passed in.
     """
-    resume_skills = parsed_resume_data.get('skills', [])
+    jd_context = _prepare_jd(job_description_text, sbert_model)
+    if responsibility_similarity is None:
+        jd_resp_embedding, resume_embeddings = encode_resumes_for_scoring([parsed_resume_data], job_description_text,
+                                                                          sbert_model)
+        if jd_resp_embedding is not None:
+            responsibility_similarity = float(resume_embeddings[0] @ jd_resp_embedding)
+    resume_skill_embeddings = _embed_resume_skills([parsed_resume_data], jd_context, sbert_model)[0]
+    components, overall_reasoning = _score_components(parsed_resume_data, jd_context, responsibility_similarity,
+                                                      resume_skill_embeddings)
+    final_score = round(float(components @ SCORE_WEIGHTS), 2)
+    return final_score, overall_reasoning
+
+# Reasoning sentences, one per score component; _score_components collects a key and the arguments
+# of each and formats them all in one pass at the end (%d truncates the float scores like int() did)
+_REASONING_TEMPLATES = {
+    'skills_matched': "Matched %d/%d key skills (%d%%).",
+    'no_resume_skills': "No skills found in resume to match against JD skills.",
+    'no_jd_skills': "No specific skills required in JD.",
+    'experience_met': "Meets/Exceeds %d years experience (%d years found).",
+    'experience_short': "Has %d years experience (requires %d).",
+    'no_jd_experience': "No minimum experience required in JD.",
+    'responsibilities': "Overall resume content aligns with responsibilities (%d%%).",
+    'no_responsibility_data': "Cannot assess responsibilities due to missing JD or resume content.",
+    'education': "Education matches JD requirements (%d%%).",
+    'no_jd_education': "No specific education required in JD.",
+}
+
+def _score_components(parsed_resume_data: Dict, jd_context: JDContext, responsibility_similarity: Optional[float],
+                      resume_skill_embeddings: Optional[np.ndarray]) -> (np.ndarray, str):
+    """
+    Computes the four 0-100 component scores of a resume (weighted by SCORE_WEIGHTS)
+    and the reasoning string. jd_context comes from _prepare_jd; responsibility_similarity is
+    None when the JD lists no responsibilities, otherwise computed by the caller (see score_resume).
+    resume_skill_embeddings comes from _embed_resume_skills. No model runs here, so this is safe
+    to call on the scoring worker processes.
+    """
+    resume_skills = _canonical_skills(parsed_resume_data.get('skills', []))
     resume_experience_text = " ".join(parsed_resume_data.get('experience', []))
     resume_education_text = " ".join(parsed_resume_data.get('education', []))
     resume_name = parsed_resume_data.get('name', 'Candidate')
     
-    jd_requirements = _extract_jd_requirements(job_description_text)
+    jd_requirements = jd_context.requirements
     jd_required_skills = jd_requirements.get('skills', [])
     jd_responsibilities = jd_requirements.get('responsibilities', [])
     jd_min_experience_years = jd_requirements.get('experience_years', 0)
     jd_required_education = jd_requirements.get('education', [])
 
-    total_score = 0
-    reasoning_parts = []
+    # JD skills the resume lists verbatim match outright, lexical before semantic: a set lookup replaces
+    # comparing their embeddings (an identical string would score 1.0 anyway). Both sides are lowercased.
+    remaining_jd_skill_ids = []
+    if jd_required_skills and resume_skills:
+        resume_skill_set = set(resume_skills)
+        remaining_jd_skill_ids = [i for i, skill in enumerate(jd_required_skills) if skill not in resume_skill_set]
+
+    # Resumes sent to a scoring worker carry has_raw_text instead of their raw text (see _for_scoring_worker)
+    has_raw_text = parsed_resume_data.get('has_raw_text', bool(parsed_resume_data.get('raw_text')))
+    has_responsibility_data = bool(jd_responsibilities and has_raw_text)
+
+    reasoning_parts = [] # (template key, *args) per component, formatted once at the end
 
     # --- 1. Skill Matching (Highest Weight) ---
     skill_match_score = 0
     if jd_required_skills:
-        # Generate embeddings for JD skills and resume skills
-        jd_skill_embeddings = sbert_model.encode(jd_required_skills, convert_to_tensor=True)
-        resume_skill_embeddings = sbert_model.encode(resume_skills, convert_to_tensor=True)
+        if len(resume_skills) > 0:
+            matched_jd_skills = len(jd_required_skills) - len(remaining_jd_skill_ids)
 
-        if len(resume_skill_embeddings) > 0:
-            # Calculate similarity matrix between JD skills and resume skills
-            cosine_scores = util.cos_sim(jd_skill_embeddings, resume_skill_embeddings)
-            
-            # For each required JD skill, find its best match in resume skills
-            matched_jd_skills = 0
-            for i in range(len(jd_required_skills)):
-                if len(cosine_scores) > 0 and len(cosine_scores[i]) > 0:
-                    max_sim = cosine_scores[i].max().item()
-                    if max_sim > 0.6: # Threshold for a "match"
-                        matched_jd_skills += 1
+            if remaining_jd_skill_ids:
+                jd_skill_embeddings = np.ascontiguousarray(jd_context.skill_embeddings[remaining_jd_skill_ids], dtype=np.float32)
+                resume_skill_embeddings = np.ascontiguousarray(resume_skill_embeddings, dtype=np.float32)
+
+                # For each remaining JD skill, check whether its best match in resume skills is a "match";
+                # the embeddings are normalized, so the dot products are the cosine similarities
+                matched_jd_skills += _count_skill_matches(jd_skill_embeddings, resume_skill_embeddings,
+                                                          SKILL_MATCH_THRESHOLD)
             
             skill_match_score = (matched_jd_skills / len(jd_required_skills)) * 100
-            reasoning_parts.append(f"Matched {matched_jd_skills}/{len(jd_required_skills)} key skills ({int(skill_match_score)}%).")
+            reasoning_parts.append(('skills_matched', matched_jd_skills, len(jd_required_skills), skill_match_score))
         else:
-            reasoning_parts.append("No skills found in resume to match against JD skills.")
+            reasoning_parts.append(('no_resume_skills',))
             skill_match_score = 0
     else:
-        reasoning_parts.append("No specific skills required in JD.")
+        reasoning_parts.append(('no_jd_skills',))
         skill_match_score = 100 # No skills required, so full score for this part
 
-    total_score += skill_match_score * 0.40 # 40% weight for skills
-
     # --- 2. Experience Years Matching ---
     experience_years_in_resume = 0
     if parsed_resume_data.get('experience'):
-        # Try to extract years from the parsed experience text
-        exp_match = re.search(r'(\d+)\s+years', resume_experience_text, re.IGNORECASE)
-        if exp_match:
-            experience_years_in_resume = int(exp_match.group(1))
+        # Try to extract years from the parsed experience text; the largest figure claimed wins
+        matches = _EXP_YEARS_RE.findall(resume_experience_text)
+        experience_years_in_resume = max(map(int, matches), default=0)
 
     experience_score = 0
     if jd_min_experience_years > 0:
         if experience_years_in_resume >= jd_min_experience_years:
             experience_score = 100
-            reasoning_parts.append(f"Meets/Exceeds {jd_min_experience_years} years experience ({experience_years_in_resume} years found).")
+            reasoning_parts.append(('experience_met', jd_min_experience_years, experience_years_in_resume))
         else:
             experience_score = (experience_years_in_resume / jd_min_experience_years) * 100 if jd_min_experience_years > 0 else 0
-            reasoning_parts.append(f"Has {experience_years_in_resume} years experience (requires {jd_min_experience_years}).")
+            reasoning_parts.append(('experience_short', experience_years_in_resume, jd_min_experience_years))
     else:
         experience_score = 100 # No minimum experience required
-        reasoning_parts.append("No minimum experience required in JD.")
-    
-    total_score += experience_score * 0.30 # 30% weight for experience years
+        reasoning_parts.append(('no_jd_experience',))
 
     # --- 3. Responsibility/Summary Semantic Match ---
     responsibility_score = 0
-    if jd_responsibilities and parsed_resume_data.get('raw_text'):
-        jd_resp_text = " ".join(jd_responsibilities)
-        resume_summary_or_raw = parsed_resume_data.get('raw_text') # Use raw text for broader context
-        
-        jd_resp_embedding = sbert_model.encode(jd_resp_text, convert_to_tensor=True)
-        resume_overall_embedding = sbert_model.encode(resume_summary_or_raw, convert_to_tensor=True)
-        
-        sim = util.cos_sim(jd_resp_embedding, resume_overall_embedding).item()
-        responsibility_score = sim * 100
-        reasoning_parts.append(f"Overall resume content aligns with responsibilities ({int(responsibility_score)}%).")
+    if has_responsibility_data and responsibility_similarity is not None:
+        responsibility_score = responsibility_similarity * 100
+        reasoning_parts.append(('responsibilities', responsibility_score))
     else:
-        reasoning_parts.append("Cannot assess responsibilities due to missing JD or resume content.")
+        reasoning_parts.append(('no_responsibility_data',))
         responsibility_score = 50 # Neutral if no data to compare
 
-    total_score += responsibility_score * 0.20 # 20% weight for responsibility alignment
-
     # --- 4. Education Matching ---
     education_score = 0
     if jd_required_education:
-        matched_edu = 0
-        for req_edu in jd_required_education:
-            if req_edu.lower() in resume_education_text.lower():
-                matched_edu = 1 # Simple match if any required education is mentioned
-                break
+        # Simple match if any required education is mentioned: one scan of the resume text finds any of them
+        resume_edu_lower = resume_education_text.lower()
+        matched_edu = 1 if next(jd_context.education_automaton.iter(resume_edu_lower), None) is not None else 0
         education_score = matched_edu * 100
-        reasoning_parts.append(f"Education matches JD requirements ({int(education_score)}%).")
+        reasoning_parts.append(('education', education_score))
     else:
         education_score = 100 # No specific education required
-        reasoning_parts.append("No specific education required in JD.")
+        reasoning_parts.append(('no_jd_education',))
 
-    total_score += education_score * 0.10 # 10% weight for education
-
-    final_score = round(total_score, 2)
-    overall_reasoning = " ".join(reasoning_parts)
+    components = np.array([skill_match_score, experience_score, responsibility_score, education_score], dtype=float)
+    overall_reasoning = " ".join(_REASONING_TEMPLATES[part[0]] % part[1:] for part in reasoning_parts)
     
-    return final_score, overall_reasoning
+    return components, overall_reasoning
 
 if __name__ == '__main__':
     # For testing scoring_logic.py module
@@ -205,7 +648,7 @@ if __name__ == '__main__':
     resume_text = extract_text_from_file(dummy_resume_path)
     if resume_text:
         parsed_info = parse_resume_info(resume_text)
-        score, reasoning = score_resume(parsed_info, dummy_jd, model_sbert)
+        score, reasoning = score_resume(parsed_info, dummy_jd, get_sbert_model())
         print(f"\n--- Score for {parsed_info.get('name', 'N/A')} ---")
         print(f"Score: {score}%")
         print(f"Reasoning: {reasoning}")
@@ -218,7 +661,7 @@ if __name__ == '__main__':
         less_match_text = extract_text_from_file(less_match_resume_path)
         if less_match_text:
             parsed_less_match = parse_resume_info(less_match_text)
-            score_less, reason_less = score_resume(parsed_less_match, dummy_jd, model_sbert)
+            score_less, reason_less = score_resume(parsed_less_match, dummy_jd, get_sbert_model())
             print(f"\n--- Score for {parsed_less_match.get('name', 'N/A')} ---")
             print(f"Score: {score_less}%")
             print(f"Reasoning: {reason_less}")
\ No newline at end of file